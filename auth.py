@@ -0,0 +1,48 @@
+"""
+Auth Helper Functions
+
+Signed bearer tokens carrying the user id.
+Issue a token at login with create_token and depend on current_user in
+endpoints to get the caller's id as an ObjectId.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import jwt
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from typing import Optional
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Checked at app startup, so the helpers below can assume it is set
+auth_secret = os.getenv("AUTH_SECRET")
+
+TOKEN_ALGORITHM = "HS256"
+TOKEN_TTL = timedelta(days=7)
+
+# auto_error=False so a missing header gets the same 401 as a bad token
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+def create_token(user_id: ObjectId) -> str:
+    """Sign a token whose subject is the user id"""
+    now = datetime.now(timezone.utc)
+    claims = {"sub": str(user_id), "iat": now, "exp": now + TOKEN_TTL}
+    return jwt.encode(claims, auth_secret, algorithm=TOKEN_ALGORITHM)
+
+
+async def current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)) -> ObjectId:
+    """Dependency returning the authenticated user's id from the bearer token"""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        claims = jwt.decode(credentials.credentials, auth_secret, algorithms=[TOKEN_ALGORITHM])
+        return ObjectId(claims["sub"])
+    except (jwt.InvalidTokenError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
@@ -5,11 +5,13 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -22,11 +24,36 @@ database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=100,
+        minPoolSize=10,
+        maxIdleTimeMS=30000,
+        serverSelectionTimeoutMS=3000,
+        compressors="zstd",
+    )
     db = _client[database_name]
 
+async def ensure_indexes():
+    """Create the indexes backing the API's query predicates (idempotent)
+
+    Errors propagate so the app does not start without its indexes.
+    Called from the startup hook after it has checked db is configured.
+    """
+    await db["project"].create_index([("user_id", ASCENDING), ("_id", ASCENDING)])
+    await db["chat"].create_index([("project_id", ASCENDING), ("_id", ASCENDING)])
+    await db["message"].create_index([("chat_id", ASCENDING), ("_id", ASCENDING)])
+    try:
+        # login upserts by email and relies on this index for uniqueness
+        await db["user"].create_index([("email", ASCENDING)], unique=True)
+    except DuplicateKeyError as e:
+        raise RuntimeError(
+            "Duplicate user emails prevent creating the unique user.email index. "
+            "Merge or remove the duplicate user documents, then restart."
+        ) from e
+
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,16 +67,34 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def create_documents(collection_name: str, items: List[Union[BaseModel, dict]]):
+    """Insert several documents with timestamps in a single round-trip"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = data.model_dump() if isinstance(data, BaseModel) else data.copy()
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+
+    result = await db[collection_name].insert_many(docs, ordered=False)
+    return [str(i) for i in result.inserted_ids]
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None, sort: list = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
     cursor = db[collection_name].find(filter_dict or {})
+    if sort:
+        cursor = cursor.sort(sort)
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
@@ -1,13 +1,37 @@
 import os
-from fastapi import FastAPI, HTTPException
+import re
+import orjson
+from cachetools import TTLCache
+from datetime import datetime, timezone
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional
 from bson import ObjectId
+from pymongo import DESCENDING, ReturnDocument
 
-from database import db, create_document, get_documents
+from auth import auth_secret, create_token, current_user
+from database import db, create_document, create_documents, get_documents, ensure_indexes
 
-app = FastAPI()
+
+def orjson_default(obj):
+    """Encode BSON types orjson does not handle natively"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class ORJSONResponse(Response):
+    """JSON response rendered with orjson, skipping jsonable_encoder"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,15 +43,60 @@ app.add_middleware(
 
 
 # Utility to validate ObjectId strings
+OBJECT_ID_RE = re.compile(r"[0-9a-fA-F]{24}")
+
+
+def parse_object_id(value: str) -> ObjectId:
+    """Build an ObjectId from its hex string, raising 400 when malformed"""
+    if not OBJECT_ID_RE.fullmatch(value):
+        raise HTTPException(status_code=400, detail="Invalid ID")
+    # The 12-byte form skips bson's own string validation
+    return ObjectId(bytes.fromhex(value))
+
+
+# Keyset pagination: list endpoints return newest first, and clients pass
+# the last _id they received as `before` to fetch the next page
+MAX_PAGE_SIZE = 200
+NEWEST_FIRST = [("_id", DESCENDING)]
+
+
+def page_filter(filter_dict: dict, before: Optional[str]) -> dict:
+    """Restrict a list query to documents older than the `before` cursor"""
+    if before is not None:
+        filter_dict["_id"] = {"$lt": parse_object_id(before)}
+    return filter_dict
+
+
+def json_body_openapi(model: type[BaseModel]) -> dict:
+    """openapi_extra documenting the request body a json_body dependency reads"""
+    return {
+        "requestBody": {
+            "content": {"application/json": {"schema": model.model_json_schema()}},
+            "required": True,
+        }
+    }
+
+
+def json_body(model: type[BaseModel]):
+    """Dependency validating the raw request body against model in one pass"""
+    async def parse(request: Request):
+        body = await request.body()
+        try:
+            return model.model_validate_json(body)
+        except ValidationError as e:
+            errors = e.errors(include_url=False)
+            for err in errors:
+                err["loc"] = ("body", *err["loc"])
+            raise RequestValidationError(errors, body=body)
+    return parse
+
+
 class ObjectIdStr(BaseModel):
     id: str
 
     @property
     def oid(self) -> ObjectId:
-        try:
-            return ObjectId(self.id)
-        except Exception:
-            raise HTTPException(status_code=400, detail="Invalid ID")
+        return parse_object_id(self.id)
 
 
 # Auth models (simple email-based login placeholder)
@@ -37,24 +106,39 @@ class LoginRequest(BaseModel):
     avatar_url: Optional[str] = None
 
 
-@app.get("/")
-def read_root():
-    return {"message": "Backend ready"}
+@app.on_event("startup")
+async def prepare_database():
+    # Refuse to start without token signing or a reachable database so
+    # routes need not check
+    if not auth_secret:
+        raise RuntimeError("Auth not configured. Check AUTH_SECRET environment variable.")
+    if db is None:
+        raise RuntimeError("Database not configured. Check DATABASE_URL and DATABASE_NAME environment variables.")
+    # Also opens the pool's connections before the first request needs them
+    await db.command("ping")
+    await ensure_indexes()
 
 
-@app.post("/auth/login")
-def login(req: LoginRequest):
-    # Upsert user by email
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
+@app.get("/", response_model=None)
+async def read_root():
+    return ORJSONResponse({"message": "Backend ready"})
 
-    existing = db["user"].find_one({"email": req.email})
-    if existing:
-        db["user"].update_one({"_id": existing["_id"]}, {"$set": {"name": req.name, "avatar_url": req.avatar_url}})
-        user_id = str(existing["_id"])
-    else:
-        user_id = create_document("user", req.dict())
-    return {"user_id": user_id}
+
+@app.post("/auth/login", response_model=None, openapi_extra=json_body_openapi(LoginRequest))
+async def login(req: LoginRequest = Depends(json_body(LoginRequest))):
+    # Upsert user by email
+    now = datetime.now(timezone.utc)
+    user = await db["user"].find_one_and_update(
+        {"email": req.email},
+        {
+            "$set": {**req.model_dump(exclude_none=True), "updated_at": now},
+            "$setOnInsert": {"created_at": now},
+        },
+        projection={"_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return ORJSONResponse({"user_id": str(user["_id"]), "token": create_token(user["_id"])})
 
 
 # Project endpoints
@@ -63,24 +147,18 @@ class ProjectCreate(BaseModel):
     description: Optional[str] = None
 
 
-@app.post("/projects")
-def create_project(payload: ProjectCreate, user_id: str):
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
-    data = {"user_id": user_id, **payload.dict()}
-    project_id = create_document("project", data)
-    return {"project_id": project_id}
+@app.post("/projects", response_model=None, openapi_extra=json_body_openapi(ProjectCreate))
+async def create_project(user_id: ObjectId = Depends(current_user), payload: ProjectCreate = Depends(json_body(ProjectCreate))):
+    data = payload.model_dump(exclude_none=True)
+    data["user_id"] = user_id
+    project_id = await create_document("project", data)
+    return ORJSONResponse({"project_id": project_id})
 
 
-@app.get("/projects")
-def list_projects(user_id: str):
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
-    projects = get_documents("project", {"user_id": user_id})
-    # Convert ObjectIds
-    for p in projects:
-        p["_id"] = str(p["_id"]) if "_id" in p else None
-    return {"projects": projects}
+@app.get("/projects", response_model=None)
+async def list_projects(user_id: ObjectId = Depends(current_user), limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE), before: Optional[str] = None):
+    projects = await get_documents("project", page_filter({"user_id": user_id}, before), limit, NEWEST_FIRST)
+    return ORJSONResponse({"projects": projects})
 
 
 # Chat endpoints
@@ -89,68 +167,92 @@ class ChatCreate(BaseModel):
     title: str
 
 
-@app.post("/chats")
-def create_chat(payload: ChatCreate, user_id: str):
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
+@app.post("/chats", response_model=None, openapi_extra=json_body_openapi(ChatCreate))
+async def create_chat(user_id: ObjectId = Depends(current_user), payload: ChatCreate = Depends(json_body(ChatCreate))):
+    project_oid = parse_object_id(payload.project_id)
     # validate project belongs to user
-    proj = db["project"].find_one({"_id": ObjectId(payload.project_id), "user_id": user_id})
+    proj = await db["project"].find_one({"_id": project_oid, "user_id": user_id}, {"_id": 1})
     if not proj:
         raise HTTPException(status_code=404, detail="Project not found")
-    chat_id = create_document("chat", payload.dict())
-    return {"chat_id": chat_id}
+    data = payload.model_dump(exclude_none=True)
+    data["project_id"] = project_oid
+    chat_id = await create_document("chat", data)
+    return ORJSONResponse({"chat_id": chat_id})
 
 
-@app.get("/chats")
-def list_chats(project_id: str, user_id: str):
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
+@app.get("/chats", response_model=None)
+async def list_chats(project_id: str, user_id: ObjectId = Depends(current_user), limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE), before: Optional[str] = None):
+    project_oid = parse_object_id(project_id)
     # verify access
-    proj = db["project"].find_one({"_id": ObjectId(project_id), "user_id": user_id})
+    proj = await db["project"].find_one({"_id": project_oid, "user_id": user_id}, {"_id": 1})
     if not proj:
         raise HTTPException(status_code=404, detail="Project not found")
-    chats = get_documents("chat", {"project_id": project_id})
-    for c in chats:
-        c["_id"] = str(c["_id"]) if "_id" in c else None
-    return {"chats": chats}
+    chats = await get_documents("chat", page_filter({"project_id": project_oid}, before), limit, NEWEST_FIRST)
+    return ORJSONResponse({"chats": chats})
 
 
 # Messages
+# (chat_id, user_id) pairs already known to be authorized; chat ownership
+# only changes if a project is deleted, so a short TTL is enough
+chat_auth_cache = TTLCache(maxsize=10000, ttl=60)
+
+
+async def authorize_chat(chat_id: ObjectId, user_id: ObjectId):
+    """Check in one round-trip that the chat exists and its project belongs to the user"""
+    key = (chat_id, user_id)
+    if key in chat_auth_cache:
+        return
+    pipeline = [
+        {"$match": {"_id": chat_id}},
+        {"$project": {"project_id": 1}},
+        {"$lookup": {
+            "from": "project",
+            "let": {"project_id": "$project_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$project_id"]}, "user_id": user_id}},
+                {"$project": {"_id": 1}},
+            ],
+            "as": "project",
+        }},
+        {"$limit": 1},
+    ]
+    chats = await db["chat"].aggregate(pipeline).to_list(length=1)
+    if not chats:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    if not chats[0]["project"]:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    chat_auth_cache[key] = True
+
+
 class MessageCreate(BaseModel):
     chat_id: str
     role: str
     content: str
 
 
-@app.post("/messages")
-def create_message(payload: MessageCreate, user_id: str):
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
+@app.post("/messages", response_model=None, openapi_extra=json_body_openapi(MessageCreate))
+async def create_message(user_id: ObjectId = Depends(current_user), payload: MessageCreate = Depends(json_body(MessageCreate))):
+    chat_oid = parse_object_id(payload.chat_id)
     # validate chat belongs to user via project
-    chat = db["chat"].find_one({"_id": ObjectId(payload.chat_id)})
-    if not chat:
-        raise HTTPException(status_code=404, detail="Chat not found")
-    proj = db["project"].find_one({"_id": ObjectId(chat["project_id"]), "user_id": user_id})
-    if not proj:
-        raise HTTPException(status_code=403, detail="Forbidden")
-    msg_id = create_document("message", payload.dict())
-    return {"message_id": msg_id}
+    await authorize_chat(chat_oid, user_id)
+    data = payload.model_dump(exclude_none=True)
+    data["chat_id"] = chat_oid
+    msg_id = await create_document("message", data)
+    return ORJSONResponse({"message_id": msg_id})
 
 
-@app.get("/messages")
-def list_messages(chat_id: str, user_id: str):
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
-    chat = db["chat"].find_one({"_id": ObjectId(chat_id)})
-    if not chat:
-        raise HTTPException(status_code=404, detail="Chat not found")
-    proj = db["project"].find_one({"_id": ObjectId(chat["project_id"]), "user_id": user_id})
-    if not proj:
-        raise HTTPException(status_code=403, detail="Forbidden")
-    msgs = get_documents("message", {"chat_id": chat_id})
-    for m in msgs:
-        m["_id"] = str(m["_id"]) if "_id" in m else None
-    return {"messages": msgs}
+@app.get("/messages", response_model=None)
+async def list_messages(chat_id: str, user_id: ObjectId = Depends(current_user), limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE), before: Optional[str] = None):
+    chat_oid = parse_object_id(chat_id)
+    await authorize_chat(chat_oid, user_id)
+    cursor = db["message"].find(page_filter({"chat_id": chat_oid}, before)).sort(NEWEST_FIRST).limit(limit)
+
+    # One JSON object per line, written as documents come off the cursor
+    async def stream():
+        async for msg in cursor:
+            yield orjson.dumps(msg, default=orjson_default) + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 
 # Simple echo assistant for now
@@ -159,54 +261,60 @@ class CompletionRequest(BaseModel):
     prompt: str
 
 
-@app.post("/assistant/complete")
-def assistant_complete(req: CompletionRequest, user_id: str):
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
+@app.post("/assistant/complete", response_model=None, openapi_extra=json_body_openapi(CompletionRequest))
+async def assistant_complete(user_id: ObjectId = Depends(current_user), req: CompletionRequest = Depends(json_body(CompletionRequest))):
+    chat_oid = parse_object_id(req.chat_id)
+    await authorize_chat(chat_oid, user_id)
     # Very simple echo logic to mock agent response
     reply = f"Echo: {req.prompt}"
     # store user prompt and assistant reply
-    create_document("message", {"chat_id": req.chat_id, "role": "user", "content": req.prompt})
-    create_document("message", {"chat_id": req.chat_id, "role": "assistant", "content": reply})
-    return {"reply": reply}
+    await create_documents("message", [
+        {"chat_id": chat_oid, "role": "user", "content": req.prompt},
+        {"chat_id": chat_oid, "role": "assistant", "content": reply},
+    ])
+    return ORJSONResponse({"reply": reply})
 
 
-@app.get("/test")
-def test_database():
+# Health checks may be polled often; list collections at most every 5s
+collections_cache = TTLCache(maxsize=1, ttl=5)
+
+
+@app.get("/test", response_model=None)
+async def test_database():
+    # Startup guarantees db is configured, so only the live query can fail
     response = {
         "backend": "✅ Running",
-        "database": "❌ Not Available",
-        "database_url": None,
-        "database_name": None,
-        "connection_status": "Not Connected",
+        "database": "✅ Available",
+        "database_url": "✅ Set",
+        "database_name": "✅ Set",
+        "connection_status": "Connected",
         "collections": []
     }
 
     try:
-        if db is not None:
-            response["database"] = "✅ Available"
-            response["database_url"] = "✅ Configured"
-            response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
-            response["connection_status"] = "Connected"
-            try:
-                collections = db.list_collection_names()
-                response["collections"] = collections[:10]
-                response["database"] = "✅ Connected & Working"
-            except Exception as e:
-                response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
-        else:
-            response["database"] = "⚠️  Available but not initialized"
+        collections = collections_cache.get("names")
+        if collections is None:
+            collections = await db.list_collection_names()
+            collections_cache["names"] = collections
+        response["collections"] = collections[:10]
+        response["database"] = "✅ Connected & Working"
     except Exception as e:
-        response["database"] = f"❌ Error: {str(e)[:50]}"
-
-    import os
-    response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+        response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
 
-    return response
+    return ORJSONResponse(response)
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", 4))
+    # Multiple workers need the app as an import string
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
+        workers=workers,
+    )
@@ -0,0 +1,48 @@
+"""
+ObjectId Reference Migration
+
+Converts document references that older versions stored as 24-character
+hex strings into ObjectIds:
+- project.user_id
+- chat.project_id
+- message.chat_id
+
+Safe to re-run: only fields that are still strings are touched, and
+MongoDB updates the existing indexes in place.
+
+Usage: python migrate_object_ids.py
+"""
+
+import os
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+load_dotenv()
+
+REFERENCES = [
+    ("project", "user_id"),
+    ("chat", "project_id"),
+    ("message", "chat_id"),
+]
+
+
+def migrate(db):
+    for collection_name, field in REFERENCES:
+        result = db[collection_name].update_many(
+            {field: {"$type": "string", "$regex": "^[0-9a-fA-F]{24}$"}},
+            [{"$set": {field: {"$toObjectId": f"${field}"}}}],
+        )
+        print(f"{collection_name}.{field}: converted {result.modified_count} documents")
+
+
+if __name__ == "__main__":
+    database_url = os.getenv("DATABASE_URL")
+    database_name = os.getenv("DATABASE_NAME")
+    if not (database_url and database_name):
+        raise SystemExit("Set DATABASE_URL and DATABASE_NAME to run the migration.")
+
+    client = MongoClient(database_url)
+    try:
+        migrate(client[database_name])
+    finally:
+        client.close()
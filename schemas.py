@@ -9,11 +9,37 @@ Model name is converted to lowercase for the collection name:
 - User -> "user" collection
 - Product -> "product" collection
 - BlogPost -> "blogs" collection
+
+List endpoints return documents read from the database without
+validating them. Do not add response_model=List[Model] to a route; it
+builds one model per document. If a list of untrusted data must be
+validated, create one module-level TypeAdapter(List[Model]) and call
+validate_python() on the whole list. For data already trusted, use
+Model.model_construct().
 """
 
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, Field, PlainSerializer, PlainValidator, WithJsonSchema
+from typing import Annotated, Optional, List
 from datetime import datetime
+from bson import ObjectId
+
+
+def _validate_object_id(value) -> ObjectId:
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    raise ValueError("Invalid ObjectId")
+
+
+# Reference to another document, stored as a 12-byte ObjectId and
+# exchanged as its 24-character hex string
+PyObjectId = Annotated[
+    ObjectId,
+    PlainValidator(_validate_object_id),
+    PlainSerializer(str, return_type=str, when_used="json"),
+    WithJsonSchema({"type": "string"}),
+]
 
 class User(BaseModel):
     name: str = Field(..., description="Full name")
@@ -21,16 +47,16 @@ class User(BaseModel):
     avatar_url: Optional[str] = Field(None, description="Avatar image URL")
 
 class Project(BaseModel):
-    user_id: str = Field(..., description="Owner user id")
+    user_id: PyObjectId = Field(..., description="Owner user id")
     name: str = Field(..., description="Project name")
     description: Optional[str] = Field(None, description="Short description")
 
 class Chat(BaseModel):
-    project_id: str = Field(..., description="Project id")
+    project_id: PyObjectId = Field(..., description="Project id")
     title: str = Field(..., description="Chat title")
 
 class Message(BaseModel):
-    chat_id: str = Field(..., description="Chat id")
+    chat_id: PyObjectId = Field(..., description="Chat id")
     role: str = Field(..., description="user or assistant")
     content: str = Field(..., description="Message content")
     created_at: Optional[datetime] = None